@@ -10,8 +10,11 @@ from typing import List
 from PIL import Image
 import io
 import time
-import cv2
-from config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION, CACHE_DURATION
+from config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION, CACHE_DURATION, DEFAULT_QUALITY
+from config import SHARD_COUNT, SHARD_WORKERS, SEARCH_TOP_K
+from quality import get_profile, prepare_image, detect_faces, encode_faces
+from gallery_shards import ShardedGallery, shard_for, parse_addresses, start_local_workers
+from video_index import find_appearances
 
 app = FastAPI()
 
@@ -28,18 +31,26 @@ def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)):
         )
     return credentials.username
 
-def resize_with_aspect_ratio(image, width=None, height=None, inter=cv2.INTER_AREA):
-    dim = None
-    (h, w) = image.shape[:2]
-    if width is None and height is None:
-        return image
-    if width is None:
-        r = height / float(h)
-        dim = (int(w * r), height)
-    else:
-        r = width / float(w)
-        dim = (width, int(h * r))
-    return cv2.resize(image, dim, interpolation=inter)
+def resolve_quality(quality):
+    try:
+        return get_profile(quality or DEFAULT_QUALITY)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def encode_uploaded_images(images, profile):
+    encodings = []
+    image_sources = []
+    for image in images:
+        contents = image.file.read()
+        pil_image = Image.open(io.BytesIO(contents)).convert('RGB')
+        rgb_image = prepare_image(np.array(pil_image), profile)
+        face_locations = detect_faces(rgb_image, profile, scale=1.0)
+        if face_locations:
+            face_encodings = encode_faces(rgb_image, face_locations, profile)
+            if face_encodings:
+                encodings.append(face_encodings[0])
+                image_sources.append(image.filename)
+    return encodings, image_sources
 
 # MongoDB client (initialized on startup)
 client = None
@@ -51,9 +62,12 @@ cached_encodings = None
 cached_names = None
 last_cache_update = 0
 
+# Sharded gallery search workers (None when the gallery is held in this process)
+gallery = None
+
 @app.on_event("startup")
 async def startup_event():
-    global client, db, collection
+    global client, db, collection, gallery
     try:
         client = MongoClient(MONGODB_URI)
         db = client[MONGODB_DB_NAME]
@@ -62,6 +76,11 @@ async def startup_event():
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         raise HTTPException(status_code=500, detail=f"MongoDB connection failed: {e}")
+    if SHARD_WORKERS or SHARD_COUNT > 1:
+        addresses = parse_addresses() or start_local_workers()
+        gallery = ShardedGallery(addresses)
+        gallery.check_workers()
+        print(f"Searching gallery across {len(addresses)} shards")
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -83,37 +102,36 @@ def load_embeddings():
         last_cache_update = current_time
     return cached_encodings, cached_names
 
+def invalidate_cache(shards=()):
+    # shards: the old and new shard of the changed document
+    global cached_encodings, cached_names, last_cache_update
+    cached_encodings = None
+    cached_names = None
+    last_cache_update = 0
+    if gallery is not None:
+        gallery.reload([shard for shard in shards if shard is not None])
+
 @app.post("/add-politician")
 def add_politician(
     name: str = Form(...),
     description: str = Form(...),
     party: str = Form(...),
     images: List[UploadFile] = File(...),
+    quality: str = Form(None),
     username: str = Depends(verify_credentials)
 ):
     if not images:
         raise HTTPException(status_code=400, detail="At least one image is required.")
     
-    encodings = []
-    image_sources = []
-    for image in images:
-        contents = image.file.read()
-        pil_image = Image.open(io.BytesIO(contents)).convert('RGB')
-        rgb_image = np.array(pil_image)
-        rgb_image = resize_with_aspect_ratio(rgb_image, width=320)
-        face_locations = face_recognition.face_locations(rgb_image, model="hog")
-        if not face_locations:
-            face_locations = face_recognition.face_locations(rgb_image, model="cnn")
-        if face_locations:
-            face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-            if face_encodings:
-                encodings.append(face_encodings[0])
-                image_sources.append(image.filename)
+    profile = resolve_quality(quality)
+    encodings, image_sources = encode_uploaded_images(images, profile)
     
     if not encodings:
         raise HTTPException(status_code=400, detail="No faces detected in any uploaded images.")
 
     avg_encoding = np.mean(encodings, axis=0)
+    existing = collection.find_one({'name': name}) or {}
+    shard = shard_for({**existing, 'name': name, 'description': description, 'party': party})
     collection.update_one(
         {'name': name},
         {'$set': {
@@ -122,14 +140,12 @@ def add_politician(
             'details.image_count': len(encodings),
             'details.updated_at': datetime.now().strftime('%Y-%m-%d'),
             'description': description,
-            'party': party
+            'party': party,
+            'shard': shard
         }},
         upsert=True
     )
-    global cached_encodings, cached_names, last_cache_update
-    cached_encodings = None
-    cached_names = None
-    last_cache_update = 0
+    invalidate_cache([existing.get('shard'), shard])
     
     return {"status": "success", "message": f"Added {name} with {len(encodings)} images."}
 
@@ -140,24 +156,12 @@ def edit_politician(
     new_description: str = Form(...),
     new_party: str = Form(...),
     images: List[UploadFile] = File(None),
+    quality: str = Form(None),
     username: str = Depends(verify_credentials)
 ):
     if images:
-        encodings = []
-        image_sources = []
-        for image in images:
-            contents = image.file.read()
-            pil_image = Image.open(io.BytesIO(contents)).convert('RGB')
-            rgb_image = np.array(pil_image)
-            rgb_image = resize_with_aspect_ratio(rgb_image, width=320)
-            face_locations = face_recognition.face_locations(rgb_image, model="hog")
-            if not face_locations:
-                face_locations = face_recognition.face_locations(rgb_image, model="cnn")
-            if face_locations:
-                face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-                if face_encodings:
-                    encodings.append(face_encodings[0])
-                    image_sources.append(image.filename)
+        profile = resolve_quality(quality)
+        encodings, image_sources = encode_uploaded_images(images, profile)
         
         if encodings:
             avg_encoding = np.mean(encodings, axis=0)
@@ -173,6 +177,11 @@ def edit_politician(
         'party': new_party,
         'details.updated_at': datetime.now().strftime('%Y-%m-%d')
     }
+    # The shard key may be a stored field the form does not send (e.g. region)
+    existing = collection.find_one({'name': old_name})
+    if existing is None:
+        raise HTTPException(status_code=404, detail="Politician not found.")
+    update_fields['shard'] = shard_for({**existing, **update_fields})
     if embedding_hex:
         update_fields['face_embedding'] = embedding_hex
         update_fields['details.image_sources'] = image_sources
@@ -184,63 +193,57 @@ def edit_politician(
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Politician not found.")
-    global cached_encodings, cached_names, last_cache_update
-    cached_encodings = None
-    cached_names = None
-    last_cache_update = 0
+    invalidate_cache([existing.get('shard'), update_fields['shard']])
     
     return {"status": "success", "message": f"Edited {old_name} to {new_name}."}
 
 @app.post("/verify-image")
-def verify_image(file: UploadFile = File(...)):
+def verify_image(file: UploadFile = File(...), quality: str = Form(None)):
     start_time = time.time()
+    profile = resolve_quality(quality)
     try:
         contents = file.file.read()
         pil_image = Image.open(io.BytesIO(contents)).convert('RGB')
-        rgb_image = np.array(pil_image)
-        rgb_image = resize_with_aspect_ratio(rgb_image, width=320)
+        rgb_image = prepare_image(np.array(pil_image), profile)
         print(f"Resized image shape: {rgb_image.shape}")
 
-        known_encodings, known_names = load_embeddings()
-        print(f"Loaded {len(known_encodings)} embeddings")
-
-        # Speed Optimization: Resize image to 1/4 size for faster face detection
-        small_frame = cv2.resize(rgb_image, (0, 0), fx=0.25, fy=0.25)
-        
-        # Find faces in the small frame
-        face_locations = face_recognition.face_locations(small_frame, model="hog")
-        if not face_locations:
-            face_locations = face_recognition.face_locations(small_frame, model="cnn")
+        # Speed Optimization: detect on a downscaled frame (per the quality profile)
+        # and scale the face locations back up to the resized image
+        face_locations = detect_faces(rgb_image, profile)
         
         if not face_locations:
             raise HTTPException(status_code=400, detail="No face detected")
 
-        # Scale face locations back up to original size
-        face_locations = [(top*4, right*4, bottom*4, left*4) for (top, right, bottom, left) in face_locations]
-
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        face_encodings = encode_faces(rgb_image, face_locations, profile)
         if not face_encodings:
             raise HTTPException(status_code=400, detail="No face encoding detected")
         face_encoding = face_encodings[0]
 
-        matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.6)
-        face_distances = face_recognition.face_distance(known_encodings, face_encoding)
+        if gallery is not None:
+            # Scatter the probe to every shard and merge their top-k matches
+            top_matches = gallery.search(face_encoding, SEARCH_TOP_K)
+        else:
+            known_encodings, known_names = load_embeddings()
+            print(f"Loaded {len(known_encodings)} embeddings")
+            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
+            top_matches = [(float(face_distances[i]), known_names[i]) for i in np.argsort(face_distances)[:SEARCH_TOP_K]]
 
-        if any(matches):
-            best_match_index = np.argmin(face_distances)
-            if matches[best_match_index]:
-                name = known_names[best_match_index]
-                doc = collection.find_one({'name': name})
-                print(f"Verification took {time.time() - start_time:.2f} seconds")
-                return {
-                    "matched": True,
-                    "name": name,
-                    "description": doc.get('description'),
-                    "party": doc.get('party'),
-                    "distance": face_distances[best_match_index]
-                }
+        # The closest SEARCH_TOP_K identities, so callers can spot near-ties
+        candidates = [{"name": name, "distance": distance} for distance, name in top_matches]
+        if top_matches and top_matches[0][0] <= profile["tolerance"]:
+            distance, name = top_matches[0]
+            doc = collection.find_one({'name': name})
+            print(f"Verification took {time.time() - start_time:.2f} seconds")
+            return {
+                "matched": True,
+                "name": name,
+                "description": doc.get('description'),
+                "party": doc.get('party'),
+                "distance": distance,
+                "candidates": candidates
+            }
         print(f"Verification took {time.time() - start_time:.2f} seconds")
-        return {"matched": False, "name": "Unknown", "distance": min(face_distances) if face_distances.size else None}
+        return {"matched": False, "name": "Unknown", "distance": top_matches[0][0] if top_matches else None, "candidates": candidates}
     except Exception as e:
         print(f"Error in verify_image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
@@ -251,15 +254,18 @@ async def get_politicians():
     names = [doc['name'] for doc in collection.find({}, {'name': 1})]
     return {"politicians": names}
 
+@app.get("/appearances")
+def get_appearances(name: str):
+    # Answered from the video index built by video_index.py, no video is decoded
+    return {"name": name, "appearances": find_appearances(name)}
+
 @app.post("/delete-politician")
 def delete_politician(name: str = Form(...), username: str = Depends(verify_credentials)):
+    existing = collection.find_one({'name': name}, {'shard': 1}) or {}
     result = collection.delete_one({'name': name})
     
     # Force cache refresh
-    global cached_encodings, cached_names, last_cache_update
-    cached_encodings = None
-    cached_names = None
-    last_cache_update = 0
+    invalidate_cache([existing.get('shard')])
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Politician not found.")
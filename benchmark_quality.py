@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import numpy as np
+import face_recognition
+from quality import QUALITY_PROFILES, prepare_image, detect_faces, encode_faces
+
+# Benchmarks every quality profile on the labelled dataset using leave-one-out:
+# each image is verified against a gallery averaged from the remaining images.
+default_dataset = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
+
+def load_dataset(dataset_path):
+    samples = []
+    for person_name in sorted(os.listdir(dataset_path)):
+        person_folder = os.path.join(dataset_path, person_name)
+        if not os.path.isdir(person_folder):
+            continue
+        for image_file in sorted(os.listdir(person_folder)):
+            if image_file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                image_path = os.path.join(person_folder, image_file)
+                samples.append((person_name, face_recognition.load_image_file(image_path)))
+    return samples
+
+def encode_first(image, profile, scale=None):
+    rgb_image = prepare_image(image, profile)
+    face_locations = detect_faces(rgb_image, profile, scale=scale)
+    if not face_locations:
+        return None
+    face_encodings = encode_faces(rgb_image, face_locations, profile)
+    return face_encodings[0] if face_encodings else None
+
+def benchmark_profile(samples, profile):
+    # Enrollment path (full-resolution detection) builds the gallery
+    enrolled = [encode_first(image, profile, scale=1.0) for _, image in samples]
+
+    # Verification path is what gets timed
+    probes = []
+    latencies = []
+    for _, image in samples:
+        start_time = time.perf_counter()
+        probes.append(encode_first(image, profile))
+        latencies.append(time.perf_counter() - start_time)
+
+    correct = 0
+    no_face = 0
+    for i, (person_name, _) in enumerate(samples):
+        if probes[i] is None:
+            no_face += 1
+            continue
+        gallery_names = []
+        gallery_encodings = []
+        for name in sorted(set(n for n, _ in samples)):
+            encodings = [enrolled[j] for j, (n, _) in enumerate(samples) if n == name and j != i and enrolled[j] is not None]
+            if encodings:
+                gallery_names.append(name)
+                gallery_encodings.append(np.mean(encodings, axis=0))
+        if not gallery_encodings:
+            continue
+        face_distances = face_recognition.face_distance(gallery_encodings, probes[i])
+        best_match_index = np.argmin(face_distances)
+        if face_distances[best_match_index] <= profile["tolerance"] and gallery_names[best_match_index] == person_name:
+            correct += 1
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "accuracy": correct / len(samples),
+        "no_face": no_face,
+        "mean_ms": float(np.mean(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95))
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report latency and accuracy of each quality profile.")
+    parser.add_argument("--dataset", default=default_dataset, help="Folder with one sub-folder of images per person")
+    parser.add_argument("--profiles", nargs="+", default=list(QUALITY_PROFILES), choices=list(QUALITY_PROFILES))
+    args = parser.parse_args()
+
+    samples = load_dataset(args.dataset)
+    print(f"Loaded {len(samples)} images from {args.dataset}")
+    print(f"{'profile':<10} {'accuracy':>9} {'no face':>8} {'mean ms':>9} {'p95 ms':>9}")
+    for quality in args.profiles:
+        result = benchmark_profile(samples, QUALITY_PROFILES[quality])
+        print(f"{quality:<10} {result['accuracy']:>9.2%} {result['no_face']:>8} {result['mean_ms']:>9.1f} {result['p95_ms']:>9.1f}")
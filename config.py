@@ -13,4 +13,18 @@ API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", 8000))
 
 # Cache settings
-CACHE_DURATION = int(os.getenv("CACHE_DURATION", 60))  # Cache duration in seconds
\ No newline at end of file
+CACHE_DURATION = int(os.getenv("CACHE_DURATION", 60))  # Cache duration in seconds
+
+# Quality profile used when a request does not specify one (fast, balanced, accurate)
+DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "balanced")
+
+# Gallery sharding (SHARD_COUNT=1 keeps the whole gallery in the API process)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+SHARD_KEY = os.getenv("SHARD_KEY", "name")  # Document field hashed to pick a shard, e.g. name or party
+SHARD_WORKERS = os.getenv("SHARD_WORKERS", "")  # Comma-separated host:port list; empty starts local worker processes
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", 9100))
+SHARD_AUTHKEY = os.getenv("SHARD_AUTHKEY", "")  # Shared secret for shard RPC; required when sharding
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", 5))
+
+# Video appearance index written by video_index.py
+VIDEO_INDEX_DIR = os.getenv("VIDEO_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "video_index"))
\ No newline at end of file
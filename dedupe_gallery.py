@@ -0,0 +1,271 @@
+import os
+import csv
+import json
+import pickle
+import argparse
+
+# Every worker already runs in its own process, so keep BLAS single-threaded
+# instead of oversubscribing the machine with cpu_count() x BLAS threads
+for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(variable, "1")
+
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from pymongo import MongoClient
+from config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION
+
+# Offline all-pairs similarity job over the stored face_embedding gallery.
+# Distances are computed block by block (block_size x block_size at a time) from a
+# memory-mapped matrix shared by the worker processes, and only the closest
+# max_pairs pairs of every identity are kept, so memory stays bounded at any
+# gallery size. Results are kept in a state folder so later runs only compare
+# newly enrolled (or re-enrolled) identities against the rest of the gallery.
+default_state_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedupe_state")
+
+# Gallery matrix of the worker process, opened once by init_worker
+worker_matrix = None
+
+def init_worker(matrix_path):
+    global worker_matrix
+    worker_matrix = np.load(matrix_path, mmap_mode='r')
+
+def compare_block(task):
+    # Compares rows [r0, r1) against columns [c0, c1) and returns the pairs under
+    # the threshold plus the nearest neighbour of every row and column in the block.
+    r0, r1, c0, c1, threshold, max_pairs = task
+    rows = np.asarray(worker_matrix[r0:r1], dtype=np.float32)
+    cols = np.asarray(worker_matrix[c0:c1], dtype=np.float32)
+
+    sq_dist = (rows * rows).sum(axis=1)[:, None] + (cols * cols).sum(axis=1)[None, :] - 2.0 * rows @ cols.T
+    dist = np.sqrt(np.maximum(sq_dist, 0.0))
+
+    # On the diagonal only keep the upper triangle so every pair is seen once
+    if c1 > r0:
+        row_idx = np.arange(r0, r1)[:, None]
+        col_idx = np.arange(c0, c1)[None, :]
+        dist[col_idx >= row_idx] = np.inf
+
+    pair_rows, pair_cols = np.nonzero(dist < threshold)
+    pairs, pair_dist = cap_pairs(
+        np.stack([pair_rows + r0, pair_cols + c0], axis=1).astype(np.int64),
+        dist[pair_rows, pair_cols].astype(np.float32),
+        max_pairs
+    )
+    row_nn = dist.argmin(axis=1)
+    col_nn = dist.argmin(axis=0)
+    return (
+        r0, c0, pairs, pair_dist,
+        dist[np.arange(r1 - r0), row_nn], row_nn + c0,
+        dist[col_nn, np.arange(c1 - c0)], col_nn + r0
+    )
+
+def cap_pairs(pairs, pair_dist, max_pairs):
+    # Keeps a pair if it is among the max_pairs closest pairs of either identity
+    order = np.argsort(pair_dist, kind="stable")
+    pairs, pair_dist = pairs[order], pair_dist[order]
+    identities = pairs.reshape(-1)
+    pair_index = np.repeat(np.arange(len(pairs)), 2)
+    by_identity = np.argsort(identities, kind="stable")
+    sorted_identities = identities[by_identity]
+    rank = np.arange(len(identities)) - np.searchsorted(sorted_identities, sorted_identities, side="left")
+    keep = np.zeros(len(pairs), dtype=bool)
+    keep[pair_index[by_identity[rank < max_pairs]]] = True
+    return pairs[keep], pair_dist[keep]
+
+def load_gallery(collection):
+    names = []
+    encodings = []
+    for doc in collection.find({'face_embedding': {'$exists': True}}, {'name': 1, 'face_embedding': 1}):
+        names.append(doc['name'])
+        encodings.append(pickle.loads(bytes.fromhex(doc['face_embedding'])))
+    return names, np.array(encodings, dtype=np.float32).reshape(len(names), -1)
+
+def load_state(state_dir):
+    names_path = os.path.join(state_dir, "names.json")
+    if not os.path.exists(names_path):
+        return None
+    with open(names_path) as f:
+        names = json.load(f)
+    results = np.load(os.path.join(state_dir, "results.npz"))
+    return {
+        "names": names,
+        "matrix": np.load(os.path.join(state_dir, "embeddings.npy")),
+        "pairs": results["pairs"],
+        "pair_dist": results["pair_dist"],
+        "nn_dist": results["nn_dist"],
+        "nn_idx": results["nn_idx"],
+        "threshold": float(results["threshold"]) if "threshold" in results.files else None,
+        "max_pairs": int(results["max_pairs"]) if "max_pairs" in results.files else None
+    }
+
+def plan_rows(names, matrix, state):
+    # Returns the gallery reordered as [unchanged identities..., fresh identities...]
+    # together with the results carried over for the unchanged part.
+    if state is None:
+        return names, matrix, 0, np.empty((0, 2), np.int64), np.empty(0, np.float32), np.empty(0, np.float32), np.empty(0, np.int64)
+
+    old_index = {name: i for i, name in enumerate(state["names"])}
+    current_index = {name: i for i, name in enumerate(names)}
+    unchanged = np.zeros(len(state["names"]), dtype=bool)
+    for name, i in current_index.items():
+        j = old_index.get(name)
+        if j is not None and np.array_equal(state["matrix"][j], matrix[i]):
+            unchanged[j] = True
+
+    # An unchanged identity whose nearest neighbour was removed or re-enrolled
+    # has a stale result, so it is compared again as if it were new
+    nn_idx = state["nn_idx"]
+    kept = unchanged & ((nn_idx < 0) | unchanged[np.maximum(nn_idx, 0)])
+
+    # Likewise for identities that lost a pair: a pair dropped by the cap may
+    # now be among their closest, so their pairs are searched again
+    old_pairs = state["pairs"]
+    lost = ~unchanged[old_pairs[:, 0]] | ~unchanged[old_pairs[:, 1]]
+    kept[old_pairs[lost].reshape(-1)] = False
+
+    kept_old = np.flatnonzero(kept)
+    kept_names = [state["names"][j] for j in kept_old]
+    kept_set = set(kept_names)
+    fresh_names = [name for name in names if name not in kept_set]
+
+    ordered_names = kept_names + fresh_names
+    ordered_matrix = np.concatenate([
+        state["matrix"][kept_old],
+        matrix[[current_index[name] for name in fresh_names]].reshape(len(fresh_names), matrix.shape[1])
+    ]).astype(np.float32)
+
+    # Kept identities may have an unchanged nearest neighbour that is being
+    # compared again, so map every unchanged identity to its new position
+    new_index = {name: i for i, name in enumerate(ordered_names)}
+    remap = np.full(len(state["names"]), -1, dtype=np.int64)
+    for j in np.flatnonzero(unchanged):
+        remap[j] = new_index[state["names"][j]]
+    pair_mask = kept[state["pairs"][:, 0]] & kept[state["pairs"][:, 1]] if len(state["pairs"]) else np.zeros(0, dtype=bool)
+    pairs = remap[state["pairs"][pair_mask]]
+    pair_dist = state["pair_dist"][pair_mask]
+    nn_dist = state["nn_dist"][kept_old]
+    nn_idx = np.where(nn_idx[kept_old] >= 0, remap[np.maximum(nn_idx[kept_old], 0)], -1)
+    return ordered_names, ordered_matrix, len(kept_old), pairs, pair_dist, nn_dist, nn_idx
+
+def build_tasks(n_old, n_total, block_size, threshold, max_pairs):
+    # Each block of fresh rows is compared with every row before it and with
+    # itself; on a first run (n_old == 0) this is the upper triangle of blocks.
+    tasks = []
+    for r0 in range(n_old, n_total, block_size):
+        r1 = min(r0 + block_size, n_total)
+        for c0 in range(0, r1, block_size):
+            tasks.append((r0, r1, c0, min(c0 + block_size, r1), threshold, max_pairs))
+    return tasks
+
+def find_clusters(n, pairs):
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        root_a, root_b = find(int(a)), find(int(b))
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    clusters = {}
+    for i in np.unique(pairs):
+        clusters.setdefault(find(int(i)), []).append(int(i))
+    return [members for members in clusters.values() if len(members) > 1]
+
+def run(names, matrix, state_dir, threshold, max_pairs, block_size, workers, incremental):
+    state = load_state(state_dir) if incremental else None
+    if state is not None and (state["threshold"] != threshold or state["max_pairs"] != max_pairs):
+        print("Threshold or pair cap changed since the last run, comparing the full gallery")
+        state = None
+    names, matrix, n_old, pairs, pair_dist, nn_dist, nn_idx = plan_rows(names, matrix, state)
+    n_total = len(names)
+    print(f"Gallery has {n_total} identities, {n_total - n_old} to compare")
+
+    os.makedirs(state_dir, exist_ok=True)
+    matrix_path = os.path.join(state_dir, "embeddings.npy")
+    np.save(matrix_path, matrix)
+
+    nn_dist = np.concatenate([nn_dist, np.full(n_total - n_old, np.inf, dtype=np.float32)]).astype(np.float32)
+    nn_idx = np.concatenate([nn_idx, np.full(n_total - n_old, -1, dtype=np.int64)])
+    pair_chunks = [pairs]
+    pair_dist_chunks = [pair_dist]
+    buffered = len(pairs)
+    prune_limit = max(1000000, 4 * n_total * max_pairs)
+
+    tasks = build_tasks(n_old, n_total, block_size, threshold, max_pairs)
+    with Pool(workers, initializer=init_worker, initargs=(matrix_path,)) as pool:
+        for r0, c0, block_pairs, block_dist, row_dist, row_nn, col_dist, col_nn in pool.imap_unordered(compare_block, tasks):
+            pair_chunks.append(block_pairs)
+            pair_dist_chunks.append(block_dist)
+            buffered += len(block_pairs)
+            if buffered > prune_limit:
+                pairs, pair_dist = cap_pairs(np.concatenate(pair_chunks).reshape(-1, 2), np.concatenate(pair_dist_chunks), max_pairs)
+                pair_chunks, pair_dist_chunks, buffered = [pairs], [pair_dist], len(pairs)
+            for start, dist, idx in ((r0, row_dist, row_nn), (c0, col_dist, col_nn)):
+                window = slice(start, start + len(dist))
+                closer = dist < nn_dist[window]
+                nn_dist[window] = np.where(closer, dist, nn_dist[window])
+                nn_idx[window] = np.where(closer, idx, nn_idx[window])
+
+    pairs, pair_dist = cap_pairs(np.concatenate(pair_chunks).reshape(-1, 2), np.concatenate(pair_dist_chunks), max_pairs)
+    with open(os.path.join(state_dir, "names.json"), "w") as f:
+        json.dump(names, f)
+    np.savez(
+        os.path.join(state_dir, "results.npz"),
+        pairs=pairs, pair_dist=pair_dist, nn_dist=nn_dist, nn_idx=nn_idx, threshold=threshold, max_pairs=max_pairs
+    )
+    return names, pairs, pair_dist, nn_dist, nn_idx
+
+def write_report(state_dir, names, pairs, pair_dist, nn_dist, nn_idx):
+    order = np.argsort(pair_dist)
+    clusters = find_clusters(len(names), pairs)
+    report = {
+        "pairs": [
+            {"a": names[pairs[i, 0]], "b": names[pairs[i, 1]], "distance": float(pair_dist[i])}
+            for i in order
+        ],
+        "clusters": [sorted(names[i] for i in members) for members in clusters]
+    }
+    with open(os.path.join(state_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(state_dir, "nearest_neighbours.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "nearest", "distance"])
+        for i, name in enumerate(names):
+            nearest = names[nn_idx[i]] if nn_idx[i] >= 0 else ""
+            writer.writerow([name, nearest, f"{nn_dist[i]:.4f}"])
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate identities in the face_embedding gallery.")
+    parser.add_argument("--threshold", type=float, default=0.4, help="Report identity pairs closer than this distance")
+    parser.add_argument("--max-pairs", type=int, default=5, help="Keep at most this many closest pairs per identity")
+    parser.add_argument("--block-size", type=int, default=2048, help="Rows/columns compared per block")
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--state-dir", default=default_state_dir, help="Folder for results and incremental state")
+    parser.add_argument("--incremental", action="store_true", help="Only compare identities that are new or changed since the last run")
+    args = parser.parse_args()
+
+    try:
+        client = MongoClient(MONGODB_URI)
+        collection = client[MONGODB_DB_NAME][MONGODB_COLLECTION]
+        gallery_names, gallery_matrix = load_gallery(collection)
+        client.close()
+    except Exception as e:
+        print(f"Error loading gallery from MongoDB: {e}")
+        exit(1)
+
+    if not gallery_names:
+        print("No embeddings found in MongoDB. Run update_embeddings.py first.")
+        exit(1)
+
+    results = run(gallery_names, gallery_matrix, args.state_dir, args.threshold, args.max_pairs, args.block_size, args.workers, args.incremental)
+    report = write_report(args.state_dir, *results)
+    print(f"Found {len(report['pairs'])} pairs under {args.threshold} in {len(report['clusters'])} clusters")
+    for pair in report["pairs"][:20]:
+        print(f"  {pair['a']} <-> {pair['b']}: {pair['distance']:.3f}")
+    print(f"Report written to {args.state_dir}")
@@ -79,6 +79,7 @@ cam_manager = get_camera_manager()
 # --- Sidebar Menu ---
 st.sidebar.title("Face AI System")
 menu = st.sidebar.radio("Main Menu", ["🔍 Verification", "⚙️ Admin Panel"])
+quality = st.sidebar.selectbox("Quality", ["fast", "balanced", "accurate"], index=1)
 
 st.sidebar.divider()
 st.sidebar.subheader("📋 Verifiable Persons")
@@ -118,7 +119,7 @@ if menu == "🔍 Verification":
             def verify_bg(frame_data, cam_mgr):
                 try:
                     files = {"file": ("frame.jpg", frame_data, "image/jpeg")}
-                    resp = requests.post(f"{API_URL}/verify-image", files=files, timeout=10)
+                    resp = requests.post(f"{API_URL}/verify-image", data={"quality": quality}, files=files, timeout=10)
                     if resp.status_code == 200:
                         cam_mgr.last_result = resp.json()
                     else:
@@ -157,7 +158,7 @@ if menu == "🔍 Verification":
         up_file = st.file_uploader("Verify image", type=["jpg", "png"])
         if up_file:
             with st.spinner("Analyzing..."):
-                res = requests.post(f"{API_URL}/verify-image", files={"file": up_file}, timeout=30).json()
+                res = requests.post(f"{API_URL}/verify-image", data={"quality": quality}, files={"file": up_file}, timeout=30).json()
                 if res.get("matched"):
                     st.success(f"Matched: {res['name']}")
                     st.info(f"Party: {res['party']}\n\n{res['description']}")
@@ -198,7 +199,7 @@ elif menu == "⚙️ Admin Panel":
                         st.error("⚠️ Name and at least one Image are required!")
                     else:
                         files = [("images", i) for i in imgs]
-                        r = requests.post(f"{API_URL}/add-politician", data={"name":n,"description":d,"party":py}, files=files, auth=(st.session_state.admin_username, st.session_state.admin_password))
+                        r = requests.post(f"{API_URL}/add-politician", data={"name":n,"description":d,"party":py,"quality":quality}, files=files, auth=(st.session_state.admin_username, st.session_state.admin_password))
                         if r.status_code == 200: st.success("Added!"); time.sleep(1); st.rerun()
                         else: st.error("Error: Could not add person. Check if the image has a clear face.")
 
@@ -209,7 +210,7 @@ elif menu == "⚙️ Admin Panel":
                 new_d = st.text_area("New Description")
                 new_p = st.text_input("New Party")
                 if st.form_submit_button("Update"):
-                    r = requests.post(f"{API_URL}/edit-politician", data={"old_name":target, "new_name":new_n, "new_description":new_d, "new_party":new_p}, auth=(st.session_state.admin_username, st.session_state.admin_password))
+                    r = requests.post(f"{API_URL}/edit-politician", data={"old_name":target, "new_name":new_n, "new_description":new_d, "new_party":new_p, "quality":quality}, auth=(st.session_state.admin_username, st.session_state.admin_password))
                     if r.status_code == 200: st.success("Updated!"); time.sleep(1); st.rerun()
 
         with st.expander("🗑️ Delete Person"):
@@ -0,0 +1,225 @@
+import time
+import zlib
+import pickle
+import heapq
+import argparse
+import threading
+import numpy as np
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from concurrent.futures import ThreadPoolExecutor, wait
+from pymongo import MongoClient
+from config import (
+    MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION, CACHE_DURATION,
+    SHARD_COUNT, SHARD_KEY, SHARD_WORKERS, SHARD_BASE_PORT, SHARD_AUTHKEY
+)
+
+# The gallery is partitioned by a stable hash of SHARD_KEY ("name", or a tenant
+# field such as "party"). Each document stores its shard number so a search
+# worker only loads its own part of the collection. Workers answer requests over
+# multiprocessing.connection, so a shard can be a local process or another node.
+# That RPC unpickles what it receives, so an authkey that is not the example
+# value is required before anything listens or connects.
+
+def check_authkey():
+    if not SHARD_AUTHKEY or SHARD_AUTHKEY == "change-me":
+        raise ValueError("SHARD_AUTHKEY must be set to a private value before shard workers can run")
+
+def shard_for(doc, shard_count=SHARD_COUNT, shard_key=SHARD_KEY):
+    value = str(doc.get(shard_key) or "")
+    return zlib.crc32(value.encode("utf-8")) % shard_count
+
+class ShardWorker:
+    def __init__(self, shard, collection=None):
+        self.shard = shard
+        if collection is None:
+            collection = MongoClient(MONGODB_URI)[MONGODB_DB_NAME][MONGODB_COLLECTION]
+        self.collection = collection
+        self.lock = threading.Lock()
+        self.encodings = np.empty((0, 128))
+        self.names = []
+        self.last_update = 0
+
+    def load(self):
+        names = []
+        encodings = []
+        query = {'shard': self.shard, 'face_embedding': {'$exists': True}}
+        for doc in self.collection.find(query, {'name': 1, 'face_embedding': 1}):
+            names.append(doc['name'])
+            encodings.append(pickle.loads(bytes.fromhex(doc['face_embedding'])))
+        with self.lock:
+            self.names = names
+            self.encodings = np.array(encodings).reshape(len(names), 128)
+            self.last_update = time.time()
+        return len(names)
+
+    def search(self, face_encoding, k):
+        if time.time() - self.last_update > CACHE_DURATION:
+            self.load()
+        with self.lock:
+            encodings, names = self.encodings, self.names
+        if not names:
+            return []
+        face_distances = np.linalg.norm(encodings - face_encoding, axis=1)
+        k = min(k, len(names))
+        top = np.argpartition(face_distances, k - 1)[:k]
+        return [(float(face_distances[i]), names[i]) for i in top]
+
+    def handle(self, conn):
+        try:
+            while True:
+                request = conn.recv()
+                if request[0] == "search":
+                    conn.send(self.search(request[1], request[2]))
+                elif request[0] == "reload":
+                    conn.send(self.load())
+                elif request[0] == "info":
+                    conn.send({"shard": self.shard, "shard_count": SHARD_COUNT, "shard_key": SHARD_KEY})
+                else:
+                    conn.send(None)
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+    def serve(self, host, port):
+        self.load()
+        print(f"Shard {self.shard} serving {len(self.names)} embeddings on {host}:{port}")
+        with Listener((host, port), authkey=SHARD_AUTHKEY.encode()) as listener:
+            while True:
+                try:
+                    # accept() runs the authkey handshake, which port probes and
+                    # clients with the wrong key fail
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    print(f"Shard {self.shard} rejected a connection: {e!r}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+def serve_shard(shard, host, port, collection=None):
+    check_authkey()
+    ShardWorker(shard, collection).serve(host, port)
+
+def start_local_workers(shard_count=SHARD_COUNT, base_port=SHARD_BASE_PORT, collection=None):
+    # Runs every shard as a process on this machine; returns their addresses.
+    # collection defaults to MongoDB; tests pass an in-memory one.
+    check_authkey()
+    addresses = []
+    for shard in range(shard_count):
+        port = base_port + shard
+        Process(target=serve_shard, args=(shard, "127.0.0.1", port, collection), daemon=True).start()
+        addresses.append(("127.0.0.1", port))
+    return addresses
+
+def parse_addresses(workers=SHARD_WORKERS):
+    addresses = []
+    for worker in workers.split(","):
+        if worker.strip():
+            host, port = worker.strip().rsplit(":", 1)
+            addresses.append((host, int(port)))
+    return addresses
+
+class ShardedGallery:
+    def __init__(self, addresses, connect_timeout=30):
+        check_authkey()
+        self.addresses = addresses
+        self.connect_timeout = connect_timeout
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(addresses))
+
+    def connection(self, shard):
+        # One connection per shard and calling thread, opened on first use
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = {}
+        if shard not in conns:
+            deadline = time.time() + self.connect_timeout
+            while True:
+                try:
+                    conns[shard] = Client(self.addresses[shard], authkey=SHARD_AUTHKEY.encode())
+                    break
+                except ConnectionRefusedError:
+                    # Local workers may still be starting up
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.2)
+        return conns[shard]
+
+    def call(self, shard, request):
+        conn = self.connection(shard)
+        try:
+            conn.send(request)
+            return conn.recv()
+        except (EOFError, OSError):
+            self.local.conns.pop(shard, None)
+            raise
+
+    def scatter(self, request):
+        futures = [self.executor.submit(self.call, shard, request) for shard in range(len(self.addresses))]
+        return [future.result() for future in futures]
+
+    def search(self, face_encoding, k=1):
+        # Returns the k closest (distance, name) pairs across all shards
+        results = self.scatter(("search", np.asarray(face_encoding), k))
+        return heapq.nsmallest(k, (match for shard_matches in results for match in shard_matches))
+
+    def reload(self, shards, timeout=5):
+        # Best effort: a shard that cannot reload now picks the change up on its
+        # own CACHE_DURATION refresh, so failures are only logged
+        futures = {shard: self.executor.submit(self.call, shard, ("reload",)) for shard in set(shards)}
+        wait(futures.values(), timeout=timeout)
+        for shard, future in futures.items():
+            if not future.done():
+                print(f"Shard {shard} did not reload within {timeout}s")
+            elif future.exception() is not None:
+                print(f"Shard {shard} failed to reload: {future.exception()!r}")
+
+    def check_workers(self, shard_count=SHARD_COUNT, shard_key=SHARD_KEY):
+        # Every shard must be searched exactly once, so the worker at position i
+        # has to serve shard i of the same partitioning
+        if len(self.addresses) != shard_count:
+            raise ValueError(f"Expected {shard_count} shard workers, got {len(self.addresses)}")
+        for position, info in enumerate(self.scatter(("info",))):
+            if info != {"shard": position, "shard_count": shard_count, "shard_key": shard_key}:
+                host, port = self.addresses[position]
+                raise ValueError(f"Worker {host}:{port} serves {info}, expected shard {position} of {shard_count} by {shard_key}")
+
+def assign_shards(collection, shard_count=SHARD_COUNT, shard_key=SHARD_KEY):
+    # Backfills the shard field, e.g. after changing SHARD_COUNT or SHARD_KEY
+    updates = 0
+    for doc in collection.find({}, {'name': 1, shard_key: 1, 'shard': 1}):
+        shard = shard_for(doc, shard_count, shard_key)
+        if doc.get('shard') != shard:
+            collection.update_one({'_id': doc['_id']}, {'$set': {'shard': shard}})
+            updates += 1
+    return updates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve or assign gallery shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run the search worker for one shard")
+    serve_parser.add_argument("--shard", type=int, required=True)
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Use 0.0.0.0 to accept other nodes")
+    serve_parser.add_argument("--port", type=int, default=None, help="Defaults to SHARD_BASE_PORT + shard")
+    subparsers.add_parser("assign", help="Store the shard number on every document")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if not 0 <= args.shard < SHARD_COUNT:
+            print(f"Error: --shard must be between 0 and {SHARD_COUNT - 1}")
+            exit(1)
+        port = args.port if args.port is not None else SHARD_BASE_PORT + args.shard
+        try:
+            serve_shard(args.shard, args.host, port)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+    else:
+        try:
+            client = MongoClient(MONGODB_URI)
+            collection = client[MONGODB_DB_NAME][MONGODB_COLLECTION]
+            print(f"Assigned shards to {assign_shards(collection)} documents ({SHARD_COUNT} shards by {SHARD_KEY})")
+            client.close()
+        except Exception as e:
+            print(f"Error assigning shards: {e}")
+            exit(1)
@@ -0,0 +1,83 @@
+import cv2
+import face_recognition
+
+# Named quality profiles trading detection/encoding cost against accuracy.
+# "balanced" reproduces the settings the API has always used.
+QUALITY_PROFILES = {
+    "fast": {
+        "resize_width": 320,      # Width the uploaded image is resized to
+        "detection_scale": 0.25,  # Extra downscale applied before detection on /verify-image
+        "upsample": 0,            # number_of_times_to_upsample for the detector
+        "detectors": ["hog"],     # Detector cascade, tried in order until a face is found
+        "landmark_model": "small",
+        "num_jitters": 1,
+        "tolerance": 0.6
+    },
+    "balanced": {
+        "resize_width": 320,
+        "detection_scale": 0.25,
+        "upsample": 1,
+        "detectors": ["hog", "cnn"],
+        "landmark_model": "small",
+        "num_jitters": 1,
+        "tolerance": 0.6
+    },
+    "accurate": {
+        "resize_width": 640,
+        "detection_scale": 1.0,
+        "upsample": 1,
+        "detectors": ["cnn", "hog"],
+        "landmark_model": "large",
+        "num_jitters": 10,
+        "tolerance": 0.5
+    }
+}
+
+def get_profile(quality):
+    if quality not in QUALITY_PROFILES:
+        raise ValueError(f"Unknown quality profile '{quality}'. Choose one of: {', '.join(QUALITY_PROFILES)}")
+    return QUALITY_PROFILES[quality]
+
+def resize_with_aspect_ratio(image, width=None, height=None, inter=cv2.INTER_AREA):
+    dim = None
+    (h, w) = image.shape[:2]
+    if width is None and height is None:
+        return image
+    if width is None:
+        r = height / float(h)
+        dim = (int(w * r), height)
+    else:
+        r = width / float(w)
+        dim = (width, int(h * r))
+    return cv2.resize(image, dim, interpolation=inter)
+
+def prepare_image(rgb_image, profile):
+    return resize_with_aspect_ratio(rgb_image, width=profile["resize_width"])
+
+def detect_faces(rgb_image, profile, scale=None):
+    # Enrollment passes scale=1.0; verification uses the profile's detection_scale
+    if scale is None:
+        scale = profile["detection_scale"]
+    small_frame = rgb_image if scale == 1.0 else cv2.resize(rgb_image, (0, 0), fx=scale, fy=scale)
+
+    face_locations = []
+    for model in profile["detectors"]:
+        face_locations = face_recognition.face_locations(
+            small_frame, number_of_times_to_upsample=profile["upsample"], model=model
+        )
+        if face_locations:
+            break
+
+    # Scale face locations back up to the prepared image size
+    return [
+        (int(top / scale), int(right / scale), int(bottom / scale), int(left / scale))
+        for (top, right, bottom, left) in face_locations
+    ]
+
+def encode_faces(rgb_image, face_locations, profile):
+    return face_recognition.face_encodings(
+        rgb_image,
+        face_locations,
+        num_jitters=profile["num_jitters"],
+        model=profile["landmark_model"]
+    )
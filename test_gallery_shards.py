@@ -0,0 +1,80 @@
+import os
+import time
+import pickle
+import socket
+import unittest
+
+# Shard settings are read from the environment when config is imported
+os.environ["SHARD_COUNT"] = "3"
+os.environ["SHARD_KEY"] = "name"
+os.environ["SHARD_AUTHKEY"] = "test-shard-key"
+
+import numpy as np
+from gallery_shards import ShardedGallery, shard_for, start_local_workers
+
+BASE_PORT = int(os.getenv("TEST_SHARD_BASE_PORT", 9370))
+
+class InMemoryCollection:
+    # Just enough of a pymongo collection for ShardWorker.load
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return [doc for doc in self.docs if doc.get('shard') == query['shard'] and 'face_embedding' in doc]
+
+def make_docs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(count):
+        doc = {'name': f"person_{i}", 'party': "test", 'face_embedding': pickle.dumps(rng.normal(size=128)).hex()}
+        doc['shard'] = shard_for(doc)
+        docs.append(doc)
+    return docs
+
+class ShardedGalleryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.docs = make_docs(90)
+        cls.names = [doc['name'] for doc in cls.docs]
+        cls.encodings = np.array([pickle.loads(bytes.fromhex(doc['face_embedding'])) for doc in cls.docs])
+        cls.addresses = start_local_workers(3, BASE_PORT, InMemoryCollection(cls.docs))
+        cls.gallery = ShardedGallery(cls.addresses, connect_timeout=10)
+
+    def single_process_search(self, face_encoding, k):
+        face_distances = np.linalg.norm(self.encodings - face_encoding, axis=1)
+        return [self.names[i] for i in np.argsort(face_distances)[:k]]
+
+    def test_shard_for_is_stable_and_in_range(self):
+        shards = [shard_for(doc) for doc in self.docs]
+        self.assertEqual(shards, [doc['shard'] for doc in self.docs])
+        self.assertEqual(set(shards), {0, 1, 2})
+        self.assertEqual(shard_for({'name': "a", 'region': "eu"}, 3, 'region'), shard_for({'name': "b", 'region': "eu"}, 3, 'region'))
+
+    def test_check_workers(self):
+        self.gallery.check_workers()
+        with self.assertRaises(ValueError):
+            ShardedGallery(list(reversed(self.addresses)), connect_timeout=10).check_workers()
+        with self.assertRaises(ValueError):
+            ShardedGallery(self.addresses[:2], connect_timeout=10).check_workers()
+
+    def test_merged_top_k_matches_single_process_search(self):
+        rng = np.random.default_rng(1)
+        for probe in [self.encodings[7] + 0.01, rng.normal(size=128)]:
+            matches = self.gallery.search(probe, 5)
+            self.assertEqual([name for _, name in matches], self.single_process_search(probe, 5))
+            self.assertEqual([distance for distance, _ in matches], sorted(distance for distance, _ in matches))
+
+    def test_worker_survives_failed_handshake(self):
+        probe = socket.create_connection(self.addresses[0])
+        probe.close()
+        time.sleep(0.2)
+        fresh_client = ShardedGallery(self.addresses, connect_timeout=1)
+        self.assertEqual(len(fresh_client.search(self.encodings[0], 3)), 3)
+
+    def test_reload_ignores_unreachable_shard(self):
+        unreachable = ShardedGallery([("127.0.0.1", BASE_PORT + 50)], connect_timeout=0)
+        unreachable.reload([0], timeout=2)
+        self.gallery.reload([0, 2])
+
+if __name__ == "__main__":
+    unittest.main()
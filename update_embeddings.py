@@ -5,6 +5,7 @@ import pickle
 from pymongo import MongoClient
 from datetime import datetime
 from config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION
+from gallery_shards import shard_for
 
 # Absolute path to dataset
 dataset_path = r"C:\Users\USER\Projects\FaceVerificationAppPoliticians\dataset"
@@ -82,7 +83,8 @@ for person_name in os.listdir(dataset_path):
                             'details.image_count': len(encodings),
                             'details.updated_at': datetime.now().strftime('%Y-%m-%d'),
                             'description': description,
-                            'party': party
+                            'party': party,
+                            'shard': shard_for({**(collection.find_one({'name': db_name}) or {}), **db_info})
                         }},
                         upsert=True
                     )
@@ -0,0 +1,302 @@
+import os
+import cv2
+import json
+import pickle
+import hashlib
+import argparse
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from pymongo import MongoClient
+from config import MONGODB_URI, MONGODB_DB_NAME, MONGODB_COLLECTION, DEFAULT_QUALITY, VIDEO_INDEX_DIR
+from quality import QUALITY_PROFILES, get_profile, resize_with_aspect_ratio, detect_faces, encode_faces
+
+# Offline indexer for recorded footage. A video is split into fixed-length
+# segments that are sampled, detected, encoded and matched in a process pool.
+# Each segment's face records are stored column by column (timestamp, box,
+# encoding, identity, distance) and then merged into appearance intervals that
+# are filed per identity, so a query reads one small file. Segments whose
+# sampled frames are unchanged since the last run are not detected again, and a
+# gallery change only re-matches the stored encodings.
+
+# Gallery and settings of the worker process, set once by init_worker
+worker_names = None
+worker_matrix = None
+worker_profile = None
+worker_resize_width = None
+
+def init_worker(names, matrix, quality, resize_width=None):
+    global worker_names, worker_matrix, worker_profile, worker_resize_width
+    worker_names = names
+    worker_matrix = matrix
+    worker_profile = get_profile(quality)
+    worker_resize_width = resize_width
+
+def sample_frames(video_path, start, end, sample_interval):
+    # Yields (timestamp, BGR frame) every sample_interval seconds within [start, end)
+    capture = cv2.VideoCapture(video_path)
+    capture.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+    next_sample = start
+    try:
+        while capture.grab():
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if timestamp >= end:
+                break
+            if timestamp < next_sample:
+                continue
+            ret, frame = capture.retrieve()
+            if not ret:
+                break
+            yield timestamp, frame
+            next_sample += sample_interval * (1 + int((timestamp - next_sample) // sample_interval))
+    finally:
+        capture.release()
+
+def detect_segment(frames):
+    timestamps, boxes, encodings = [], [], []
+    for timestamp, frame in frames:
+        # Faces in recorded footage are small, so frames keep their native width
+        # (or --resize-width) instead of the profile's kiosk-tuned resize_width
+        # and detection_scale
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if worker_resize_width:
+            rgb_frame = resize_with_aspect_ratio(rgb_frame, width=worker_resize_width)
+        face_locations = detect_faces(rgb_frame, worker_profile, scale=1.0)
+        if not face_locations:
+            continue
+        scale = frame.shape[1] / float(rgb_frame.shape[1])
+        for location, face_encoding in zip(face_locations, encode_faces(rgb_frame, face_locations, worker_profile)):
+            timestamps.append(timestamp)
+            boxes.append([int(v * scale) for v in location])
+            encodings.append(face_encoding)
+    return {
+        "timestamp": np.array(timestamps, dtype=np.float32),
+        "box": np.array(boxes, dtype=np.int32).reshape(-1, 4),  # top, right, bottom, left
+        "encoding": np.array(encodings, dtype=np.float32).reshape(-1, 128)
+    }
+
+def match_segment(records):
+    identity = np.full(len(records["encoding"]), -1, dtype=np.int32)
+    distance = np.full(len(records["encoding"]), np.inf, dtype=np.float32)
+    if len(worker_names):
+        for i, face_encoding in enumerate(records["encoding"]):
+            face_distances = np.linalg.norm(worker_matrix - face_encoding, axis=1)
+            best_match_index = int(np.argmin(face_distances))
+            distance[i] = face_distances[best_match_index]
+            if distance[i] <= worker_profile["tolerance"]:
+                identity[i] = best_match_index
+    return {**records, "identity": identity, "distance": distance}
+
+def index_segment(task):
+    (video_path, segment, start, end, sample_interval, detect_key, previous_fingerprint,
+     video_unchanged, gallery_key, previous_gallery_key, out_path) = task
+    exists = os.path.exists(out_path)
+
+    if video_unchanged and previous_fingerprint and exists:
+        # Same file and settings as last time, no need to decode at all
+        fingerprint, records = previous_fingerprint, None
+    else:
+        frames = list(sample_frames(video_path, start, end, sample_interval))
+        # Cheap fingerprint of the sampled frames decides whether detection is needed
+        fingerprint = hashlib.md5(detect_key.encode())
+        for timestamp, frame in frames:
+            fingerprint.update(np.float32(timestamp).tobytes())
+            fingerprint.update(cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (16, 16)).tobytes())
+        fingerprint = fingerprint.hexdigest()
+        records = None if fingerprint == previous_fingerprint and exists else detect_segment(frames)
+
+    detected = records is not None
+    if not detected and gallery_key == previous_gallery_key:
+        return segment, fingerprint, False, False
+
+    if not detected:
+        with np.load(out_path) as stored:
+            records = {column: stored[column] for column in ("timestamp", "box", "encoding")}
+    np.savez(out_path, **match_segment(records))
+    return segment, fingerprint, detected, True
+
+def merge_appearances(records, max_gap):
+    # Merges consecutive records of the same identity into [start, end] intervals
+    known = records["identity"] >= 0
+    identity = records["identity"][known]
+    timestamp = records["timestamp"][known]
+    distance = records["distance"][known]
+    order = np.lexsort((timestamp, identity))
+    identity, timestamp, distance = identity[order], timestamp[order], distance[order]
+
+    breaks = np.flatnonzero((np.diff(identity) != 0) | (np.diff(timestamp) > max_gap)) + 1
+    starts = np.concatenate([[0], breaks]).astype(np.int64) if len(identity) else np.empty(0, np.int64)
+    ends = np.concatenate([breaks, [len(identity)]]).astype(np.int64) if len(identity) else np.empty(0, np.int64)
+    return {
+        "identity": identity[starts],
+        "start": timestamp[starts],
+        "end": timestamp[ends - 1],
+        "distance": np.minimum.reduceat(distance, starts) if len(starts) else np.empty(0, np.float32),
+        "detections": (ends - starts).astype(np.int32)
+    }
+
+def load_gallery(collection):
+    names = []
+    encodings = []
+    for doc in collection.find({'face_embedding': {'$exists': True}}, {'name': 1, 'face_embedding': 1}):
+        names.append(doc['name'])
+        encodings.append(pickle.loads(bytes.fromhex(doc['face_embedding'])))
+    return names, np.array(encodings).reshape(len(names), 128)
+
+def video_dir(index_dir, video_path):
+    key = hashlib.md5(os.path.abspath(video_path).encode()).hexdigest()[:12]
+    return os.path.join(index_dir, f"{os.path.splitext(os.path.basename(video_path))[0]}_{key}")
+
+def write_json(path, data):
+    # Queries may read these files during a build, so never expose a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+def identity_path(index_dir, name):
+    return os.path.join(index_dir, "identities", hashlib.md5(name.encode("utf-8")).hexdigest() + ".json")
+
+def file_identities(index_dir, video, appearances_by_name, previous_names):
+    # Replaces this video's intervals in the per-identity files it touches
+    os.makedirs(os.path.join(index_dir, "identities"), exist_ok=True)
+    for name in set(previous_names) | set(appearances_by_name):
+        path = identity_path(index_dir, name)
+        entry = {"name": name, "videos": {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                entry = json.load(f)
+        entry["videos"].pop(video, None)
+        if name in appearances_by_name:
+            entry["videos"][video] = appearances_by_name[name]
+        if entry["videos"]:
+            write_json(path, entry)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def index_video(pool, video_path, names, matrix, quality, sample_rate, segment_seconds, resize_width=None, index_dir=VIDEO_INDEX_DIR):
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        print(f"Error: Could not open {video_path}")
+        return
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25
+    duration = capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+    capture.release()
+
+    video = os.path.abspath(video_path)
+    out_dir = video_dir(index_dir, video_path)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # Sampling settings invalidate detections; the gallery only invalidates matches
+    detect_key = hashlib.md5(json.dumps([quality, sample_rate, segment_seconds, resize_width]).encode()).hexdigest()
+    gallery = hashlib.md5(json.dumps(names).encode())
+    gallery.update(matrix.tobytes())
+    gallery_key = gallery.hexdigest()
+    stat = os.stat(video_path)
+    same_settings = manifest.get("detect_key") == detect_key
+    previous = manifest.get("segments", {}) if same_settings else {}
+    video_unchanged = same_settings and manifest.get("size") == stat.st_size and manifest.get("mtime") == stat.st_mtime
+    previous_gallery_key = manifest.get("gallery_key")
+
+    segment_count = int(np.ceil(duration / segment_seconds))
+    tasks = []
+    for segment in range(segment_count):
+        start = segment * segment_seconds
+        end = min(start + segment_seconds, duration)
+        out_path = os.path.join(out_dir, f"segment_{segment:05d}.npz")
+        tasks.append((video_path, segment, start, end, 1.0 / sample_rate, detect_key, previous.get(str(segment)),
+                      video_unchanged, gallery_key, previous_gallery_key, out_path))
+
+    fingerprints = {}
+    detected = 0
+    matched = 0
+    for segment, fingerprint, segment_detected, segment_matched in pool.imap_unordered(index_segment, tasks):
+        fingerprints[str(segment)] = fingerprint
+        detected += segment_detected
+        matched += segment_matched
+    print(f"{video_path}: {detected} of {segment_count} segments detected, {matched} matched ({duration:.0f}s of video)")
+
+    # Drop segments past the end of a video that got shorter
+    for file_name in os.listdir(out_dir):
+        if file_name.startswith("segment_") and int(file_name[8:13]) >= segment_count:
+            os.remove(os.path.join(out_dir, file_name))
+
+    records = {"timestamp": [], "identity": [], "distance": []}
+    for segment in range(segment_count):
+        with np.load(os.path.join(out_dir, f"segment_{segment:05d}.npz")) as stored:
+            for column in records:
+                records[column].append(stored[column])
+    records = {column: np.concatenate(values) if values else np.empty(0) for column, values in records.items()}
+    appearances = merge_appearances(records, max_gap=2.0 / sample_rate)
+
+    appearances_by_name = {}
+    for i in range(len(appearances["identity"])):
+        appearances_by_name.setdefault(names[int(appearances["identity"][i])], []).append([
+            float(appearances["start"][i]), float(appearances["end"][i]),
+            float(appearances["distance"][i]), int(appearances["detections"][i])
+        ])
+    file_identities(index_dir, video, appearances_by_name, manifest.get("identities", []))
+
+    write_json(manifest_path, {
+            "video": video,
+            "duration": duration,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "detect_key": detect_key,
+            "gallery_key": gallery_key,
+            "identities": sorted(appearances_by_name),  # Only the people seen in this video
+            "segments": fingerprints
+        })
+
+def find_appearances(name, index_dir=VIDEO_INDEX_DIR):
+    # Answers "where does X appear" from that identity's file only
+    try:
+        with open(identity_path(index_dir, name)) as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [
+        {"video": video, "start": start, "end": end, "distance": distance, "detections": detections}
+        for video, intervals in sorted(entry["videos"].items())
+        for start, end, distance, detections in intervals
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and search face appearances in recorded videos.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--index-dir", default=VIDEO_INDEX_DIR)
+    build_parser = subparsers.add_parser("build", parents=[common], help="Index (or re-index) video files")
+    build_parser.add_argument("videos", nargs="+")
+    build_parser.add_argument("--sample-rate", type=float, default=1.0, help="Frames sampled per second of video")
+    build_parser.add_argument("--segment-seconds", type=float, default=60.0)
+    build_parser.add_argument("--quality", default=DEFAULT_QUALITY, choices=list(QUALITY_PROFILES))
+    build_parser.add_argument("--resize-width", type=int, default=None, help="Resize frames to this width before detection (default: native width)")
+    build_parser.add_argument("--workers", type=int, default=cpu_count())
+    query_parser = subparsers.add_parser("query", parents=[common], help="List where a person appears")
+    query_parser.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        for appearance in find_appearances(args.name, args.index_dir):
+            print(f"{appearance['video']}  {appearance['start']:.1f}s - {appearance['end']:.1f}s  (distance {appearance['distance']:.2f})")
+    else:
+        try:
+            client = MongoClient(MONGODB_URI)
+            gallery_names, gallery_matrix = load_gallery(client[MONGODB_DB_NAME][MONGODB_COLLECTION])
+            client.close()
+        except Exception as e:
+            print(f"Error loading gallery from MongoDB: {e}")
+            exit(1)
+        if not gallery_names:
+            print("No embeddings found in MongoDB. Run update_embeddings.py first.")
+            exit(1)
+
+        with Pool(args.workers, initializer=init_worker, initargs=(gallery_names, gallery_matrix, args.quality, args.resize_width)) as pool:
+            for video_path in args.videos:
+                index_video(pool, video_path, gallery_names, gallery_matrix, args.quality,
+                            args.sample_rate, args.segment_seconds, args.resize_width, args.index_dir)